@@ -0,0 +1,76 @@
+# Copyright (C) 2026 Stamatis Vretinaris
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import numba
+import numpy as np
+
+_BACKSLASH = ord("\\")
+_DISPLAY_PREFIX = np.array(list(b"$$\n"), dtype=np.uint8)
+_DISPLAY_SUFFIX = np.array(list(b"\n$$"), dtype=np.uint8)
+_INLINE_DELIM = np.array(list(b"$"), dtype=np.uint8)
+
+
+@numba.njit(cache=True)
+def _find_delim(buf, n, start, char):
+    """Return the index of the next backslash-char pair at or after start, or -1."""
+    for i in range(start, n - 1):
+        if buf[i] == _BACKSLASH and buf[i + 1] == char:
+            return i
+    return -1
+
+
+@numba.njit(cache=True)
+def _copy(src, start, stop, out, written):
+    """Copy src[start:stop] to out at index written and return the new write index."""
+    for i in range(start, stop):
+        out[written] = src[i]
+        written += 1
+    return written
+
+
+@numba.njit(cache=True)
+def _replace_delimited(buf, n, out, opening, closing, prefix, suffix):
+    """Write buf[:n] to out with each \\<opening>...\\<closing> pair replaced."""
+    written = 0
+    pos = 0
+    while True:
+        start = _find_delim(buf, n, pos, opening)
+        if start == -1:
+            break
+        end = _find_delim(buf, n, start + 2, closing)
+        if end == -1:
+            break
+        written = _copy(buf, pos, start, out, written)
+        written = _copy(prefix, 0, len(prefix), out, written)
+        written = _copy(buf, start + 2, end, out, written)
+        written = _copy(suffix, 0, len(suffix), out, written)
+        pos = end + 2
+    return _copy(buf, pos, n, out, written)
+
+
+def rewrite_math_delims_fast(buf: bytes) -> bytes:
+    """JIT-compiled equivalent of server._rewrite_math_delims on UTF-8 bytes."""
+    # The delimiters are ASCII, and ASCII bytes never occur inside multi-byte
+    # UTF-8 sequences, so scanning the encoded bytes is safe.
+    src = np.frombuffer(buf, dtype=np.uint8)
+    # Display math turns 2-byte delimiters into 3 bytes, so 2x always fits
+    display = np.empty(len(src) * 2, dtype=np.uint8)
+    n = _replace_delimited(
+        src, len(src), display, ord("["), ord("]"), _DISPLAY_PREFIX, _DISPLAY_SUFFIX
+    )
+    # Inline math only ever shrinks the text
+    inline = np.empty(n, dtype=np.uint8)
+    n = _replace_delimited(display, n, inline, ord("("), ord(")"), _INLINE_DELIM, _INLINE_DELIM)
+    return inline[:n].tobytes()
@@ -0,0 +1,317 @@
+# Copyright (C) 2026 Stamatis Vretinaris
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import queue
+import re
+import sys
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+import torch
+from nougat import NougatModel
+from nougat.postprocessing import markdown_compatible
+from nougat.utils.checkpoint import get_checkpoint
+from nougat.utils.dataset import LazyDataset
+from nougat.utils.device import default_batch_size, move_to_device
+
+# The model is loaded once per server process and reused across tool calls,
+# so torch import, weight loading, and CUDA context setup are paid only once.
+_MODEL: NougatModel | None = None
+_MODEL_KEY: tuple[str, bool, bool] | None = None
+_MODEL_LOCK = threading.Lock()
+# Concurrent requests share the model; page rendering runs in parallel, but
+# only one batch at a time is decoded on the device.
+_INFERENCE_LOCK = threading.Lock()
+# sys.stdout is process-wide, so concurrent requests share one redirect to
+# stderr and the last request to finish restores the original stream.
+_STDOUT_LOCK = threading.Lock()
+_STDOUT_REDIRECTS = 0
+_SAVED_STDOUT = None
+
+PRECISION_DTYPES = {
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+    "fp32": torch.float32,
+}
+
+# Throughput-optimal page batch for Nougat's (896, 672) input on a GPU
+DEFAULT_GPU_BATCH_SIZE = 10
+DEFAULT_CPU_BATCH_SIZE = 1
+# Page batches rendered and preprocessed ahead of the one being decoded
+PAGE_PREFETCH_BATCHES = 2
+
+# Marks the end of the page loader thread's output
+_LOADER_DONE = object()
+
+
+def _use_cuda() -> bool:
+    """Check if a CUDA GPU with enough memory for Nougat is present."""
+    return torch.cuda.is_available() and default_batch_size() > 0
+
+
+def _resolve_precision(precision: str | None, use_cuda: bool) -> str:
+    """Pick the model precision, falling back to fp32 on CPU."""
+    if not use_cuda:
+        return "fp32"
+    if precision is None:
+        precision = "bf16"
+    # Pre-Ampere GPUs (e.g. T4, V100) only emulate bf16, which is slower than fp16
+    if precision == "bf16" and not torch.cuda.is_bf16_supported(including_emulation=False):
+        # Older GPUs without native bf16 support still get half-precision weights
+        return "fp16"
+    return precision
+
+
+@contextmanager
+def _stdout_to_stderr():
+    """Send prints to stderr while any request is running, then restore stdout."""
+    global _STDOUT_REDIRECTS, _SAVED_STDOUT
+    with _STDOUT_LOCK:
+        if _STDOUT_REDIRECTS == 0:
+            _SAVED_STDOUT = sys.stdout
+            sys.stdout = sys.stderr
+        _STDOUT_REDIRECTS += 1
+    try:
+        yield
+    finally:
+        with _STDOUT_LOCK:
+            _STDOUT_REDIRECTS -= 1
+            if _STDOUT_REDIRECTS == 0:
+                sys.stdout = _SAVED_STDOUT
+                _SAVED_STDOUT = None
+
+
+@contextmanager
+def _inference_context(model: NougatModel):
+    """Disable autograd and autocast to the model dtype on GPU."""
+    dtype = next(model.parameters()).dtype
+    use_cuda = model.device.type == "cuda"
+    # Autocast keeps numerically sensitive ops (softmax, layer norm) in fp32
+    # while matmuls run on the half-precision weights.
+    with torch.inference_mode(), torch.autocast(
+        "cuda", dtype=dtype, enabled=use_cuda and dtype != torch.float32
+    ):
+        yield
+
+
+def _compile_model(model: NougatModel, batch_size: int) -> None:
+    """Compile the encoder and decoder forward passes and warm them up once."""
+    # The final batch of most PDFs is smaller than batch_size, so the encoder is
+    # compiled without CUDA graphs and with a dynamic batch dimension; otherwise
+    # every new tail size would recompile and record another graph.
+    # transformers<4.38 has no static KV cache, so the decoder is also compiled
+    # with dynamic shapes to follow the growing cache.
+    model.encoder.forward = torch.compile(model.encoder.forward, dynamic=True)
+    model.decoder.model.forward = torch.compile(model.decoder.model.forward, dynamic=True)
+    # Match the channels-last layout of real batches so the warmup graphs are reused
+    dummy = torch.zeros(batch_size, 3, *model.encoder.input_size, device=model.device)
+    dummy = dummy.contiguous(memory_format=torch.channels_last)
+    with _inference_context(model):
+        model.inference(image_tensors=dummy)
+
+
+def _load_in_background(
+    dataloader: Iterable[tuple[torch.Tensor | None, tuple[str, ...]]],
+) -> Iterator[tuple[torch.Tensor | None, tuple[str, ...]]]:
+    """Iterate the dataloader in a background thread, keeping a few batches ready."""
+    # Without DataLoader workers, rasterizing the PDF and preparing each batch
+    # would otherwise run between decodes on the calling thread.
+    batches: queue.Queue = queue.Queue(maxsize=PAGE_PREFETCH_BATCHES)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Give up once the consumer has stopped, rather than block on a full queue
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def load() -> None:
+        try:
+            for batch in dataloader:
+                if not put(batch):
+                    return
+        except BaseException as exc:
+            put(exc)
+            return
+        put(_LOADER_DONE)
+
+    threading.Thread(target=load, name="nougat-page-loader", daemon=True).start()
+    try:
+        while True:
+            item = batches.get()
+            if item is _LOADER_DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _prefetch_to_device(
+    dataloader: Iterable[tuple[torch.Tensor | None, tuple[str, ...]]],
+    device: torch.device,
+) -> Iterator[torch.Tensor]:
+    """Yield page batches on device, copying the next batch while the current one decodes."""
+    # On CUDA the host-to-device copy of the next (pinned) batch is issued on a
+    # side stream, so it overlaps with decoding the current batch.
+    stream = torch.cuda.Stream(device) if device.type == "cuda" else None
+    pending: torch.Tensor | None = None
+    for sample, _ in dataloader:
+        if sample is None:
+            continue
+        if stream is None:
+            staged = sample.to(device)
+        else:
+            with torch.cuda.stream(stream):
+                # Convert after the copy: a host-side conversion would allocate
+                # an unpinned tensor and make the transfer synchronous.
+                staged = sample.to(device, non_blocking=True).contiguous(
+                    memory_format=torch.channels_last
+                )
+        if pending is not None:
+            yield pending
+        pending = staged
+        if stream is not None:
+            # Make the compute stream wait for the copy before it reads the batch
+            torch.cuda.current_stream(device).wait_stream(stream)
+            pending.record_stream(torch.cuda.current_stream(device))
+    if pending is not None:
+        yield pending
+
+
+def _get_model(
+    use_cuda: bool,
+    precision: str | None = None,
+    torch_compile: bool = False,
+    batch_size: int = DEFAULT_GPU_BATCH_SIZE,
+    cpu_int8: bool = False,
+) -> NougatModel:
+    """Return the process-wide Nougat model, loading it on first use."""
+    global _MODEL, _MODEL_KEY
+    # Compilation only pays off on GPU; inductor on CPU also needs a C++ toolchain
+    key = (
+        _resolve_precision(precision, use_cuda),
+        torch_compile and use_cuda,
+        cpu_int8 and not use_cuda,
+    )
+    if _MODEL is None or _MODEL_KEY != key:
+        with _MODEL_LOCK:
+            if _MODEL is None or _MODEL_KEY != key:
+                precision, torch_compile, cpu_int8 = key
+                # The first call may download model weights (~1.4GB)
+                checkpoint = get_checkpoint(download=True)
+                model = NougatModel.from_pretrained(checkpoint).eval()
+                model = model.to(dtype=PRECISION_DTYPES[precision])
+                model = move_to_device(model, bf16=False, cuda=use_cuda)
+                if model.device.type == "cuda":
+                    # NHWC convolution kernels match the Tensor Core layout
+                    model = model.to(memory_format=torch.channels_last)
+                if cpu_int8 and model.device.type == "cpu":
+                    # The memory-bound mBART decoder dominates CPU runtime; the Swin
+                    # encoder stays fp32 since quantizing it costs accuracy.
+                    torch.ao.quantization.quantize_dynamic(
+                        model.decoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+                    )
+                if torch_compile:
+                    _compile_model(model, batch_size)
+                _MODEL = model
+                _MODEL_KEY = key
+    return _MODEL
+
+
+def predict_pdf(
+    pdf_path: str,
+    batch_size: int | None = None,
+    precision: str | None = None,
+    torch_compile: bool = False,
+    cpu_int8: bool = False,
+    skip_postprocessing: bool = False,
+) -> str:
+    """Run Nougat on a PDF in-process and return the Mathpix Markdown output."""
+    # Nougat prints progress and warnings (checkpoint download, hallucinated
+    # titles) to stdout, which carries the MCP JSON-RPC stream. The stdio
+    # transport captured the real stdout at startup, so send prints to stderr.
+    with _stdout_to_stderr():
+        return _predict_pdf(
+            pdf_path,
+            batch_size=batch_size,
+            precision=precision,
+            torch_compile=torch_compile,
+            cpu_int8=cpu_int8,
+            skip_postprocessing=skip_postprocessing,
+        )
+
+
+def _predict_pdf(
+    pdf_path: str,
+    batch_size: int | None,
+    precision: str | None,
+    torch_compile: bool,
+    cpu_int8: bool,
+    skip_postprocessing: bool,
+) -> str:
+    """Load the model if needed and run the page inference loop."""
+    # Checked once per call: nougat's default_batch_size logs a warning on CPU
+    use_cuda = _use_cuda()
+    if batch_size is None:
+        batch_size = DEFAULT_GPU_BATCH_SIZE if use_cuda else DEFAULT_CPU_BATCH_SIZE
+    model = _get_model(use_cuda, precision, torch_compile, batch_size, cpu_int8)
+    dataset = LazyDataset(
+        Path(pdf_path),
+        partial(model.encoder.prepare_input, random_padding=False),
+    )
+    # No worker processes, as in predict.py: LazyDataset rasterizes the whole
+    # PDF in every process that reads from it, so each worker would repeat the
+    # work and hold its own copy of every page image.
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        pin_memory=model.device.type == "cuda",
+        collate_fn=LazyDataset.ignore_none_collate,
+    )
+
+    predictions: list[str] = []
+    page_num = 0
+    for sample in _prefetch_to_device(_load_in_background(dataloader), model.device):
+        with _INFERENCE_LOCK, _inference_context(model):
+            model_output = model.inference(image_tensors=sample, early_stopping=True)
+        for j, output in enumerate(model_output["predictions"]):
+            page_num += 1
+            if output.strip() == "[MISSING_PAGE_POST]":
+                # Uncaught repetitions, most likely an empty page
+                predictions.append(f"\n\n[MISSING_PAGE_EMPTY:{page_num}]\n\n")
+            elif model_output["repeats"][j] is not None:
+                if model_output["repeats"][j] > 0:
+                    # Output was most likely truncated by repetitions
+                    predictions.append(f"\n\n[MISSING_PAGE_FAIL:{page_num}]\n\n")
+                else:
+                    # Page is too far from the training domain (e.g. cover pages)
+                    predictions.append(f"\n\n[MISSING_PAGE_EMPTY:{page_num}]\n\n")
+            elif skip_postprocessing:
+                predictions.append(output)
+            else:
+                predictions.append(markdown_compatible(output))
+
+    out = "".join(predictions).strip()
+    return re.sub(r"\n{3,}", "\n\n", out).strip()
@@ -16,10 +16,18 @@
 import os
 import re
 import json
+import asyncio
+import atexit
+import shutil
 import subprocess
 import tempfile
 import sys
+import time
+import hashlib
+import threading
 import importlib.util
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Literal
 from mcp.server.fastmcp import FastMCP
@@ -28,47 +36,136 @@ from mcp.server.fastmcp import FastMCP
 mcp = FastMCP("Nougat-OCR")
 
 VALID_OUTPUT_FORMATS = {"mmd", "md"}
+VALID_PRECISIONS = {"bf16", "fp16", "fp32"}
 SETTINGS_ENV_VAR = "NOUGAT_MCP_SETTINGS"
+SUBPROCESS_ENV_VAR = "NOUGAT_MCP_SUBPROCESS"
 DEFAULT_SETTINGS_FILENAME = "settings.json"
+PDF_HEADER_SEARCH_BYTES = 1024
+# Seconds to trust that no settings file exists before checking the filesystem again
+NO_SETTINGS_TTL = 2.0
+
+
+@dataclass(slots=True, frozen=True)
+class NougatConfig:
+    """Validated server settings, resolved once per settings file version."""
+
+    default_output_format: str
+    rewrite_tags: bool
+    fix_sized_delimiters: bool
+    batch_size: int | None
+    precision: str | None
+    torch_compile: bool
+    cpu_int8: bool
+    skip_postprocessing: bool
+    source: str | None
+
+
+# Parsed settings by resolved path: (mtime_ns, settings, config)
+_SETTINGS_CACHE: dict[str, tuple[int, dict, NougatConfig]] = {}
+# Candidate paths last found to have no settings file, and when that was checked
+_NO_SETTINGS_CACHE: tuple[tuple[str, ...], float] | None = None
+# Parent directory for subprocess output, created on first use and removed at exit
+_WORK_DIR: Path | None = None
+_WORK_DIR_LOCK = threading.Lock()
+
+# Math rewrites that need captured groups; applied as separate passes, in
+# this order, since a \tag{...} body only matches once its sized delimiters
+# have lost their braces.
+_RE_SIZED_DELIM = re.compile(
+    r"\\(?P<size>bigl|Bigl|biggl|Biggl|bigr|Bigr|biggr|Biggr)\{(?P<delim>[^{}]+)\}"
+)
+_RE_TAG = re.compile(r"\\tag\{([^{}]+)\}")
+
+# Below this size the UTF-8 round trip costs more than the JIT-compiled scan saves
+_NUMBA_MIN_CHARS = 1 << 16
+
+# Recent mmd_to_markdown results keyed on (text digest, rewrite_tags, fix_sized_delimiters)
+MD_CACHE_SIZE = 32
+_MD_CACHE: OrderedDict[tuple[bytes, bool, bool], str] = OrderedDict()
+_MD_CACHE_LOCK = threading.Lock()
+
+
+# Import lookups walk sys.path, so they are resolved once at import time
+_NOUGAT_AVAILABLE = importlib.util.find_spec("predict") is not None
+_NUMBA_AVAILABLE = importlib.util.find_spec("numba") is not None
 
 
 def is_nougat_available() -> bool:
     """Check if the Nougat predict module is importable."""
-    return importlib.util.find_spec("predict") is not None
+    return _NOUGAT_AVAILABLE
 
 
-def load_server_settings() -> tuple[dict, str | None]:
-    """Load settings from NOUGAT_MCP_SETTINGS or ./settings.json."""
+def use_subprocess_backend() -> bool:
+    """Check if NOUGAT_MCP_SUBPROCESS requests the `python -m predict` fallback."""
+    return os.getenv(SUBPROCESS_ENV_VAR) == "1"
+
+
+def _read_settings_file(path: Path) -> dict:
+    """Parse a settings file, unwrapping an optional "nougat_mcp" section."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+    if not isinstance(data, dict):
+        return {}
+
+    nested = data.get("nougat_mcp")
+    if isinstance(nested, dict):
+        return nested
+    return data
+
+
+def _load_settings() -> tuple[dict, NougatConfig]:
+    """Load raw settings and their resolved config, reusing cached results."""
+    global _NO_SETTINGS_CACHE
     candidates: list[Path] = []
     env_path = os.getenv(SETTINGS_ENV_VAR)
     if env_path:
         candidates.append(Path(env_path).expanduser())
     candidates.append(Path.cwd() / DEFAULT_SETTINGS_FILENAME)
 
+    # Skip the filesystem entirely if these candidates were recently found missing
+    candidate_keys = tuple(str(candidate.absolute()) for candidate in candidates)
+    if _NO_SETTINGS_CACHE is not None:
+        cached_keys, checked_at = _NO_SETTINGS_CACHE
+        if cached_keys == candidate_keys and time.monotonic() - checked_at < NO_SETTINGS_TTL:
+            return {}, _DEFAULT_CONFIG
+
     seen: set[str] = set()
     for candidate in candidates:
-        key = str(candidate.resolve()) if candidate.exists() else str(candidate.absolute())
+        try:
+            mtime = os.stat(candidate).st_mtime_ns
+        except OSError:
+            # Missing, or unreachable (e.g. a symlink loop); Path.exists() treated both as absent
+            continue
+        key = os.path.realpath(candidate)
         if key in seen:
             continue
         seen.add(key)
 
-        if not candidate.exists():
-            continue
+        # Reuse the parsed settings until the file is modified
+        cached = _SETTINGS_CACHE.get(key)
+        if cached is None or cached[0] != mtime:
+            settings = _read_settings_file(candidate)
+            cached = (mtime, settings, build_config(settings, str(candidate)))
+            _SETTINGS_CACHE[key] = cached
+        return cached[1], cached[2]
+
+    _NO_SETTINGS_CACHE = (candidate_keys, time.monotonic())
+    return {}, _DEFAULT_CONFIG
 
-        try:
-            data = json.loads(candidate.read_text(encoding="utf-8"))
-        except Exception:
-            return {}, str(candidate)
 
-        if not isinstance(data, dict):
-            return {}, str(candidate)
+def load_server_settings() -> tuple[dict, str | None]:
+    """Load settings from NOUGAT_MCP_SETTINGS or ./settings.json."""
+    settings, config = _load_settings()
+    # Hand out a copy so callers cannot modify the cached settings
+    return dict(settings), config.source
 
-        nested = data.get("nougat_mcp")
-        if isinstance(nested, dict):
-            return nested, str(candidate)
-        return data, str(candidate)
 
-    return {}, None
+def get_effective_config() -> NougatConfig:
+    """Return the resolved server config from NOUGAT_MCP_SETTINGS or ./settings.json."""
+    return _load_settings()[1]
 
 
 def resolve_default_output_format(settings: dict) -> str:
@@ -89,35 +186,276 @@ def resolve_md_conversion_settings(settings: dict) -> tuple[bool, bool]:
     )
 
 
+def resolve_batch_size(settings: dict) -> int | None:
+    """Resolve the Nougat page batch size; None selects the device default."""
+    value = settings.get("nougat_batch_size")
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+
+def resolve_precision(settings: dict) -> str | None:
+    """Resolve the Nougat model precision; None selects the device default."""
+    value = settings.get("nougat_precision")
+    if isinstance(value, str) and value in VALID_PRECISIONS:
+        return value
+    return None
+
+
+def resolve_torch_compile(settings: dict) -> bool:
+    """Resolve whether the Nougat model should be compiled with torch.compile."""
+    value = settings.get("nougat_torch_compile", False)
+    return value if isinstance(value, bool) else False
+
+
+def resolve_cpu_int8(settings: dict) -> bool:
+    """Resolve whether the decoder should be quantized to int8 for CPU inference."""
+    value = settings.get("nougat_cpu_int8", False)
+    return value if isinstance(value, bool) else False
+
+
+def resolve_skip_postprocessing(settings: dict) -> bool:
+    """Resolve whether Nougat's markdown_compatible post-processing is skipped."""
+    value = settings.get("nougat_skip_postprocessing", False)
+    return value if isinstance(value, bool) else False
+
+
+def build_config(settings: dict, source: str | None) -> NougatConfig:
+    """Validate raw settings into a NougatConfig."""
+    rewrite_tags, fix_sized_delimiters = resolve_md_conversion_settings(settings)
+    return NougatConfig(
+        default_output_format=resolve_default_output_format(settings),
+        rewrite_tags=rewrite_tags,
+        fix_sized_delimiters=fix_sized_delimiters,
+        batch_size=resolve_batch_size(settings),
+        precision=resolve_precision(settings),
+        torch_compile=resolve_torch_compile(settings),
+        cpu_int8=resolve_cpu_int8(settings),
+        skip_postprocessing=resolve_skip_postprocessing(settings),
+        source=source,
+    )
+
+
+_DEFAULT_CONFIG = build_config({}, None)
+
+
+def _normalize_sized_delim(match: re.Match[str]) -> str:
+    """Drop the braces around a sized delimiter, e.g. \\bigl{\\|} -> \\bigl\\|."""
+    delim = match.group("delim").strip()
+    if not delim:
+        return match.group(0)
+    return f"\\{match.group('size')}{delim}"
+
+
+def _replace_delimited(text: str, opening: str, closing: str, prefix: str, suffix: str) -> str:
+    """Replace each opening...closing pair with prefix...suffix, pairing non-greedily."""
+    parts: list[str] = []
+    pos = 0
+    while True:
+        start = text.find(opening, pos)
+        if start == -1:
+            break
+        end = text.find(closing, start + len(opening))
+        if end == -1:
+            break
+        parts += (text[pos:start], prefix, text[start + len(opening):end], suffix)
+        pos = end + len(closing)
+    if not parts:
+        return text
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+def _rewrite_math_delims(text: str) -> str:
+    """Convert \\[ \\] and \\( \\) math delimiters to $$ and $ with plain string scans."""
+    if _NUMBA_AVAILABLE and len(text) >= _NUMBA_MIN_CHARS:
+        # Imported lazily so numba is only loaded once a large document needs it
+        from nougat_mcp._numba_scan import rewrite_math_delims_fast
+
+        return rewrite_math_delims_fast(text.encode("utf-8")).decode("utf-8")
+
+    # Display math: \[ ... \] -> $$ ... $$
+    text = _replace_delimited(text, "\\[", "\\]", "$$\n", "\n$$")
+    # Inline math: \( ... \) -> $ ... $
+    return _replace_delimited(text, "\\(", "\\)", "$", "$")
+
+
 def mmd_to_markdown(
     mmd_text: str,
     rewrite_tags: bool = True,
     fix_sized_delimiters: bool = True,
 ) -> str:
     """Convert Nougat-style math delimiters to common Markdown math delimiters."""
-    # Display math: \[ ... \] -> $$ ... $$
-    markdown = re.sub(r"\\\[(.*?)\\\]", r"$$\n\1\n$$", mmd_text, flags=re.DOTALL)
-    # Inline math: \( ... \) -> $ ... $
-    markdown = re.sub(r"\\\((.*?)\\\)", r"$\1$", markdown, flags=re.DOTALL)
+    # Substring checks are far cheaper than a scan or a hash, so text without
+    # math skips every pass and never touches the cache
+    has_delims = "\\[" in mmd_text or "\\(" in mmd_text
+    rewrite_tags = rewrite_tags and "\\tag" in mmd_text
+    fix_sized_delimiters = fix_sized_delimiters and ("\\big" in mmd_text or "\\Big" in mmd_text)
+    if not (has_delims or rewrite_tags or fix_sized_delimiters):
+        return mmd_text
+
+    # Agents often request the same paper again, or in both formats; key on a
+    # digest so the cache never holds the multi-MB input text itself.
+    digest = hashlib.blake2b(mmd_text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    key = (digest, rewrite_tags, fix_sized_delimiters)
+    with _MD_CACHE_LOCK:
+        markdown = _MD_CACHE.get(key)
+        if markdown is not None:
+            _MD_CACHE.move_to_end(key)
+            return markdown
+
+    markdown = _convert_mmd(mmd_text, has_delims, rewrite_tags, fix_sized_delimiters)
+    with _MD_CACHE_LOCK:
+        _MD_CACHE[key] = markdown
+        _MD_CACHE.move_to_end(key)
+        while len(_MD_CACHE) > MD_CACHE_SIZE:
+            _MD_CACHE.popitem(last=False)
+    return markdown
 
+
+def _convert_mmd(
+    mmd_text: str,
+    has_delims: bool,
+    rewrite_tags: bool,
+    fix_sized_delimiters: bool,
+) -> str:
+    """Apply the mmd -> md rewrites selected by mmd_to_markdown, without caching."""
+    markdown = _rewrite_math_delims(mmd_text) if has_delims else mmd_text
     if fix_sized_delimiters:
         # Nougat sometimes outputs delimiters as \bigl{\|}, which KaTeX rejects.
         # Normalize to KaTeX-friendly \bigl\|.
-        sized_delim = re.compile(r"\\(bigl|Bigl|biggl|Biggl|bigr|Bigr|biggr|Biggr)\{([^{}]+)\}")
+        markdown = _RE_SIZED_DELIM.sub(_normalize_sized_delim, markdown)
+    if rewrite_tags:
+        # Equation tags are not universally supported; render as visible text labels.
+        markdown = _RE_TAG.sub(r"\\qquad\\text{(\1)}", markdown)
+    return markdown
 
-        def _normalize_sized_delim(match: re.Match[str]) -> str:
-            delim = match.group(2).strip()
-            if not delim:
-                return match.group(0)
-            return f"\\{match.group(1)}{delim}"
 
-        markdown = sized_delim.sub(_normalize_sized_delim, markdown)
+def _get_work_dir() -> Path:
+    """Return the per-process directory that holds subprocess output, creating it as needed."""
+    global _WORK_DIR
+    # Requests run concurrently in worker threads, so only one may create the directory
+    with _WORK_DIR_LOCK:
+        # Temp cleaners (e.g. systemd-tmpfiles) may delete it under a long-running server
+        if _WORK_DIR is None or not _WORK_DIR.is_dir():
+            _WORK_DIR = Path(tempfile.mkdtemp(prefix="nougat-mcp-"))
+            atexit.register(shutil.rmtree, _WORK_DIR, ignore_errors=True)
+        return _WORK_DIR
 
-    if rewrite_tags:
-        # Equation tags are not universally supported; render as visible text labels.
-        markdown = re.sub(r"\\tag\{([^{}]+)\}", r"\\qquad\\text{(\1)}", markdown)
 
-    return markdown
+def _read_and_remove(path: Path) -> str:
+    """Read a Nougat .mmd file and delete it."""
+    try:
+        text = path.read_bytes().decode("utf-8")
+    finally:
+        os.unlink(path)
+    # Match text-mode reads: predict.py writes \r\n line endings on Windows
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def run_nougat_subprocess(
+    file_path: str,
+    skip_postprocessing: bool = False,
+    batch_size: int | None = None,
+    precision: str | None = None,
+) -> str:
+    """Run Nougat in a separate `python -m predict` process and return the raw .mmd output."""
+    # Create a per-request directory to hold Nougat's output
+    temp_dir = tempfile.mkdtemp(dir=_get_work_dir())
+    try:
+        # Run Nougat via the current Python interpreter
+        # The first time this runs, it may download model weights (~1.4GB)
+        # --out: Specifies output directory
+        # --no-markdown: Skips markdown_compatible post-processing
+        # --batchsize: Pages decoded together
+        # --full-precision: fp32 weights; predict.py otherwise runs in bf16 and has no fp16 mode
+        # We use subprocess to isolate the intensive Torch execution
+        command = [sys.executable, "-m", "predict", file_path, "--out", temp_dir]
+        if skip_postprocessing:
+            command.append("--no-markdown")
+        if batch_size is not None:
+            command += ["--batchsize", str(batch_size)]
+        if precision == "fp32":
+            command.append("--full-precision")
+        subprocess.run(
+            command,
+            check=True,
+            capture_output=True,
+            text=True
+        )
+
+        # Nougat creates a Markdown file with a .mmd extension
+        # Note: base_name might be different if the PDF name has dots
+        # Nougat typically keeps the same base name
+        pdf_path = Path(file_path)
+        output_file = Path(temp_dir) / f"{pdf_path.stem}.mmd"
+
+        # Read the extracted Markdown and return it
+        if output_file.exists():
+            return _read_and_remove(output_file)
+
+        # Sometimes Nougat might append a suffix or handle naming differently
+        # Nougat writes flat into --out, so look for any .mmd file there first
+        with os.scandir(temp_dir) as entries:
+            mmd_file = next(
+                (entry.path for entry in entries if entry.is_file() and entry.name.endswith(".mmd")),
+                None,
+            )
+        if mmd_file is not None:
+            return _read_and_remove(Path(mmd_file))
+
+        # Search for any .mmd file recursively as a last resort
+        mmd_files = list(Path(temp_dir).rglob("*.mmd"))
+        if mmd_files:
+            return _read_and_remove(mmd_files[0])
+
+        raise FileNotFoundError(
+            f"Nougat execution succeeded but no .mmd file was found in {temp_dir}."
+        )
+    finally:
+        try:
+            os.rmdir(temp_dir)
+        except OSError:
+            # Nougat left other files behind, e.g. after a failed run
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def run_nougat_in_process(file_path: str, config: NougatConfig) -> str:
+    """Run Nougat on the server's persistent in-process model and return the raw .mmd output."""
+    # Imported lazily so the server starts without paying the torch import cost
+    from nougat_mcp.inference import predict_pdf
+
+    return predict_pdf(
+        file_path,
+        batch_size=config.batch_size,
+        precision=config.precision,
+        torch_compile=config.torch_compile,
+        cpu_int8=config.cpu_int8,
+        skip_postprocessing=config.skip_postprocessing,
+    )
+
+
+def extract_paper(file_path: str, config: NougatConfig, output_format: str) -> str:
+    """Run the configured Nougat backend and convert the result to the requested format."""
+    if use_subprocess_backend():
+        raw_mmd = run_nougat_subprocess(
+            file_path,
+            skip_postprocessing=config.skip_postprocessing,
+            batch_size=config.batch_size,
+            precision=config.precision,
+        )
+    else:
+        raw_mmd = run_nougat_in_process(file_path, config)
+
+    if output_format == "md":
+        return mmd_to_markdown(
+            raw_mmd,
+            rewrite_tags=config.rewrite_tags,
+            fix_sized_delimiters=config.fix_sized_delimiters,
+        )
+    return raw_mmd
 
 
 @mcp.tool()
@@ -126,20 +464,18 @@ def get_output_settings() -> dict:
     Return resolved output settings so agents can adapt behavior.
     Reads NOUGAT_MCP_SETTINGS or ./settings.json.
     """
-    settings, source = load_server_settings()
-    default_output_format = resolve_default_output_format(settings)
-    rewrite_tags, fix_sized_delimiters = resolve_md_conversion_settings(settings)
+    config = get_effective_config()
     return {
-        "settings_source": source,
-        "default_output_format": default_output_format,
-        "md_rewrite_tags": rewrite_tags,
-        "md_fix_sized_delimiters": fix_sized_delimiters,
+        "settings_source": config.source,
+        "default_output_format": config.default_output_format,
+        "md_rewrite_tags": config.rewrite_tags,
+        "md_fix_sized_delimiters": config.fix_sized_delimiters,
         "settings_env_var": SETTINGS_ENV_VAR,
     }
 
 
 @mcp.tool()
-def parse_research_paper(
+async def parse_research_paper(
     file_path: str,
     output_format: Literal["default", "mmd", "md"] = "default",
 ) -> str:
@@ -165,73 +501,40 @@ def parse_research_paper(
     if not file_path.lower().endswith(".pdf"):
         return "Error: The provided file is not a PDF. Nougat-OCR only supports PDF documents."
 
+    # Catch misnamed files before they reach Nougat. Readers accept the %PDF
+    # header anywhere in the first 1024 bytes, so search rather than require offset 0.
+    try:
+        with open(file_path, "rb") as f:
+            header = f.read(PDF_HEADER_SEARCH_BYTES)
+    except OSError as e:
+        return f"Error: Could not read '{file_path}': {e.strerror or e}."
+    if b"%PDF" not in header:
+        return "Error: The provided file is not a PDF. Nougat-OCR only supports PDF documents."
+
     if output_format not in {"default", "mmd", "md"}:
         return "Error: output_format must be 'default', 'mmd', or 'md'."
 
-    settings, _ = load_server_settings()
-    effective_output_format = resolve_default_output_format(settings) if output_format == "default" else output_format
-    rewrite_tags, fix_sized_delimiters = resolve_md_conversion_settings(settings)
+    config = get_effective_config()
+    effective_output_format = config.default_output_format if output_format == "default" else output_format
 
-    if not is_nougat_available():
+    if not _NOUGAT_AVAILABLE:
         return (
             "Error: Nougat is not available in the current Python environment. "
             "Please install nougat-ocr (it is included as a dependency of nougat-mcp)."
         )
 
     try:
-        # Create a temporary directory to hold Nougat's output
-        with tempfile.TemporaryDirectory() as temp_dir:
-            
-            # Run Nougat via the current Python interpreter
-            # The first time this runs, it may download model weights (~1.4GB)
-            # --out: Specifies output directory
-            # We use subprocess to isolate the intensive Torch execution
-            subprocess.run(
-                [sys.executable, "-m", "predict", file_path, "--out", temp_dir],
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            
-            # Nougat creates a Markdown file with a .mmd extension
-            # Note: base_name might be different if the PDF name has dots
-            # Nougat typically keeps the same base name
-            pdf_path = Path(file_path)
-            output_file = Path(temp_dir) / f"{pdf_path.stem}.mmd"
-            
-            # Read the extracted Markdown and return it
-            if output_file.exists():
-                raw_mmd = output_file.read_text(encoding="utf-8")
-                return (
-                    mmd_to_markdown(
-                        raw_mmd,
-                        rewrite_tags=rewrite_tags,
-                        fix_sized_delimiters=fix_sized_delimiters,
-                    )
-                    if effective_output_format == "md"
-                    else raw_mmd
-                )
-            else:
-                # Sometimes Nougat might append a suffix or handle naming differently
-                # Search for any .mmd file recursively as a fallback
-                mmd_files = list(Path(temp_dir).rglob("*.mmd"))
-                if mmd_files:
-                    raw_mmd = mmd_files[0].read_text(encoding="utf-8")
-                    return (
-                        mmd_to_markdown(
-                            raw_mmd,
-                            rewrite_tags=rewrite_tags,
-                            fix_sized_delimiters=fix_sized_delimiters,
-                        )
-                        if effective_output_format == "md"
-                        else raw_mmd
-                    )
-                
-                return f"Error: Nougat execution succeeded but no .mmd file was found in {temp_dir}."
-                
+        # Extraction and conversion block, so they run in a worker thread; the
+        # event loop stays free to accept other requests, whose page rendering
+        # then overlaps with this request's inference.
+        return await asyncio.to_thread(
+            extract_paper, file_path, config, effective_output_format
+        )
     except subprocess.CalledProcessError as e:
         stderr_msg = e.stderr.strip() if e.stderr else "Unknown error"
         return f"Error running Nougat: {stderr_msg}"
+    except FileNotFoundError as e:
+        return f"Error: {e}"
     except Exception as e:
         return f"An unexpected error occurred during extraction: {str(e)}"
 
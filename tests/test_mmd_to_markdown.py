@@ -0,0 +1,29 @@
+# Copyright (C) 2026 Stamatis Vretinaris
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+from nougat_mcp.server import mmd_to_markdown
+
+
+def test_display_math_with_tag():
+    assert mmd_to_markdown(r"\[DV=V_{x}. \tag{3.2}\]") == "$$\nDV=V_{x}. \\qquad\\text{(3.2)}\n$$"
+
+
+def test_tag_containing_sized_delimiters():
+    # Sized delimiters are normalized before tags are rewritten, so the tag
+    # body no longer contains braces and still matches.
+    assert (
+        mmd_to_markdown(r"x \tag{\Bigl{(}1\Bigr{)}}")
+        == r"x \qquad\text{(\Bigl(1\Bigr))}"
+    )
@@ -0,0 +1,57 @@
+# Copyright (C) 2026 Stamatis Vretinaris
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+pytest.importorskip("numba")
+
+from nougat_mcp._numba_scan import rewrite_math_delims_fast
+from nougat_mcp.server import _replace_delimited
+
+
+def _rewrite_with_python_scanner(text: str) -> str:
+    text = _replace_delimited(text, "\\[", "\\]", "$$\n", "\n$$")
+    return _replace_delimited(text, "\\(", "\\)", "$", "$")
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "no math here",
+        r"\[x\]",
+        r"\(x\)",
+        r"\[\]",
+        r"\(\)",
+        r"a \[x\] b \(y\) c",
+        r"\[x",
+        r"\(x",
+        r"\] before \[",
+        r"\[a\(b\)c\]",
+        r"\(a\[b\]c\)",
+        r"\[x\]\]",
+        r"\(\)\(",
+        "\\",
+        "x\\",
+        r"\\[x\\]",
+        r"\[[x]\]",
+        "\\[x\\]\n\\[y\\]",
+        r"αβ \(γ\) δ \[ε\] ζ",
+        r"\[\[x\]\]",
+    ],
+)
+def test_matches_python_scanner(text):
+    expected = _rewrite_with_python_scanner(text)
+    assert rewrite_math_delims_fast(text.encode("utf-8")).decode("utf-8") == expected
@@ -0,0 +1,108 @@
+# Copyright (C) 2026 Stamatis Vretinaris
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from nougat_mcp import server
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    """Run each test in an empty directory with fresh settings caches and a fake clock."""
+    fake = FakeClock()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv(server.SETTINGS_ENV_VAR, raising=False)
+    monkeypatch.setattr(server, "_SETTINGS_CACHE", {})
+    monkeypatch.setattr(server, "_NO_SETTINGS_CACHE", None)
+    monkeypatch.setattr(server, "time", fake)
+    return fake
+
+
+def write_settings(path: Path, settings: dict, mtime_ns: int | None = None) -> None:
+    path.write_text(json.dumps(settings), encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_settings_reread_after_edit(clock):
+    path = Path.cwd() / server.DEFAULT_SETTINGS_FILENAME
+    write_settings(path, {"default_output_format": "md"}, mtime_ns=1_000_000_000)
+    assert server.get_effective_config().default_output_format == "md"
+
+    write_settings(path, {"default_output_format": "mmd"}, mtime_ns=2_000_000_000)
+    assert server.get_effective_config().default_output_format == "mmd"
+
+
+def test_settings_created_within_ttl_seen_after_expiry(clock):
+    assert server.get_effective_config().source is None
+
+    path = Path.cwd() / server.DEFAULT_SETTINGS_FILENAME
+    write_settings(path, {"default_output_format": "md"})
+    clock.now = server.NO_SETTINGS_TTL / 2
+    assert server.get_effective_config().source is None
+
+    clock.now = server.NO_SETTINGS_TTL * 2
+    config = server.get_effective_config()
+    assert config.source == str(path)
+    assert config.default_output_format == "md"
+
+
+def test_env_path_takes_precedence(clock, tmp_path, monkeypatch):
+    write_settings(Path.cwd() / server.DEFAULT_SETTINGS_FILENAME, {"default_output_format": "mmd"})
+    env_path = tmp_path / "env" / "custom.json"
+    env_path.parent.mkdir()
+    write_settings(env_path, {"nougat_mcp": {"default_output_format": "md"}})
+    monkeypatch.setenv(server.SETTINGS_ENV_VAR, str(env_path))
+
+    config = server.get_effective_config()
+    assert config.source == str(env_path)
+    assert config.default_output_format == "md"
+
+
+def test_missing_env_path_falls_back_to_cwd(clock, tmp_path, monkeypatch):
+    path = Path.cwd() / server.DEFAULT_SETTINGS_FILENAME
+    write_settings(path, {"default_output_format": "md"})
+    monkeypatch.setenv(server.SETTINGS_ENV_VAR, str(tmp_path / "missing.json"))
+
+    config = server.get_effective_config()
+    assert config.source == str(path)
+    assert config.default_output_format == "md"
+
+
+def test_load_server_settings_returns_copy(clock):
+    write_settings(Path.cwd() / server.DEFAULT_SETTINGS_FILENAME, {"default_output_format": "md"})
+    settings, _ = server.load_server_settings()
+    settings["default_output_format"] = "mmd"
+
+    assert server.load_server_settings()[0] == {"default_output_format": "md"}
+
+
+def test_settings_symlink_loop_is_treated_as_missing(clock):
+    path = Path.cwd() / server.DEFAULT_SETTINGS_FILENAME
+    path.symlink_to(path)
+
+    assert server.load_server_settings() == ({}, None)